@@ -10,10 +10,14 @@ BASE_DIR = Path(__file__).resolve().parent
 STORAGE_DIR = BASE_DIR / "storage"
 DB_PATH = BASE_DIR / "skyframe.db"
 
+# ── SQLite WAL ─────────────────────────────────────────
+WAL_AUTOCHECKPOINT_PAGES = 10000     # ~40 MB before an automatic checkpoint
+WAL_CHECKPOINT_INTERVAL_SEC = 300    # Periodic TRUNCATE checkpoint
+
 # ── Upload limits ──────────────────────────────────────
 MAX_FILE_SIZE = 500 * 1024 * 1024  # 500 MB
-ALLOWED_MIME_TYPES = {"video/mp4", "video/quicktime"}
-ALLOWED_EXTENSIONS = {".mp4", ".mov"}
+ALLOWED_MIME_TYPES = frozenset({"video/mp4", "video/quicktime"})
+ALLOWED_EXTENSIONS = frozenset({".mp4", ".mov"})
 
 # ── Server ─────────────────────────────────────────────
 HOST = os.getenv("HOST", "0.0.0.0")
@@ -37,6 +41,21 @@ REPLICATE_MODELS = {
 DEFAULT_ENHANCE_MODEL = "upscale"
 DEFAULT_SCALE_FACTOR = 2  # 2x upscale
 
-# ── Job polling ────────────────────────────────────────
-JOB_POLL_INTERVAL_SEC = 5   # How often the worker checks Replicate status
-JOB_MAX_WAIT_SEC = 600      # 10 min timeout per job
+# ── Webhooks ───────────────────────────────────────────
+# Public base URL Replicate can reach, e.g. https://xxxx.trycloudflare.com
+PUBLIC_URL = os.getenv("PUBLIC_URL", "").rstrip("/")
+# Signing secret from https://api.replicate.com/v1/webhooks/default/secret
+REPLICATE_WEBHOOK_SECRET = os.getenv("REPLICATE_WEBHOOK_SECRET", "")
+WEBHOOKS_ENABLED = bool(PUBLIC_URL and REPLICATE_WEBHOOK_SECRET)
+WEBHOOK_TOLERANCE_SEC = 300  # Reject signatures older than this
+
+# ── Job polling (fallback without webhooks) ─────────
+JOB_POLL_INITIAL_SEC = 1.0  # First Replicate status check
+JOB_POLL_BACKOFF = 1.5      # Interval multiplier after each check
+JOB_POLL_MAX_SEC = 30.0     # Interval cap for long-running jobs
+
+# ── Output download ────────────────────────────────────
+DOWNLOAD_CONCURRENCY = 8               # Concurrent HTTP Range requests per output
+DOWNLOAD_PART_SIZE = 32 * 1024 * 1024  # 32 MB per Range request
+DOWNLOAD_CHUNK_SIZE = 4 * 1024 * 1024  # 4 MB read size per stream
+DOWNLOAD_MAX_RETRIES = 4               # Per-range attempts (exponential backoff + jitter)
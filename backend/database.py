@@ -2,8 +2,13 @@
 Database layer v2 — uploads + jobs tables
 """
 
+import asyncio
+import logging
+
 import aiosqlite
-from config import DB_PATH
+from config import DB_PATH, WAL_AUTOCHECKPOINT_PAGES, WAL_CHECKPOINT_INTERVAL_SEC
+
+logger = logging.getLogger("skyframe.database")
 
 CREATE_UPLOADS = """
 CREATE TABLE IF NOT EXISTS uploads (
@@ -16,6 +21,7 @@ CREATE TABLE IF NOT EXISTS uploads (
     status          TEXT NOT NULL DEFAULT 'uploading',
     duration_sec    REAL,
     resolution      TEXT,
+    content_hash    TEXT,
     created_at      TEXT NOT NULL,
     updated_at      TEXT
 );
@@ -40,106 +46,228 @@ CREATE TABLE IF NOT EXISTS jobs (
 """
 
 
-async def get_db() -> aiosqlite.Connection:
-    db = await aiosqlite.connect(str(DB_PATH))
-    db.row_factory = aiosqlite.Row
-    return db
+# Explicit column lists: only what the API layer actually reads
+UPLOAD_COLUMNS = (
+    "id, original_filename, storage_key, mime_type, file_size, status,"
+    " duration_sec, resolution, content_hash, created_at"
+)
+JOB_DETAIL_COLUMNS = (
+    "id, upload_id, model_name, status, progress, error_message,"
+    " output_key, created_at, completed_at"
+)
+JOB_COLUMNS = JOB_DETAIL_COLUMNS + ", replicate_id"
+
+_conn: aiosqlite.Connection | None = None
+# Serializes write+commit pairs on the shared connection. Every statement
+# already runs on aiosqlite's single worker thread; reads skip the lock, so
+# they may see another coroutine's executed-but-uncommitted write. Each write
+# helper is a single statement, so that is never a half-applied change.
+_lock = asyncio.Lock()
+_checkpoint_task: asyncio.Task | None = None
+
+
+async def connect() -> aiosqlite.Connection:
+    """Open the shared connection once; every helper below reuses it."""
+    global _conn
+    if _conn is None:
+        _conn = await aiosqlite.connect(str(DB_PATH), cached_statements=256)
+        _conn.row_factory = aiosqlite.Row
+        await _conn.execute("PRAGMA synchronous=NORMAL")
+        await _conn.execute("PRAGMA busy_timeout=5000")
+        await _conn.execute("PRAGMA temp_store=MEMORY")
+        await _conn.execute("PRAGMA cache_size=-20000")  # 20 MB
+        # Fewer, larger checkpoints; checkpoint_loop truncates the WAL periodically
+        await _conn.execute(f"PRAGMA wal_autocheckpoint={WAL_AUTOCHECKPOINT_PAGES}")
+    return _conn
+
+
+async def checkpoint():
+    """Copy the WAL back into the DB and truncate it to zero bytes."""
+    async with _lock:
+        await _conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+async def _checkpoint_loop():
+    while True:
+        await asyncio.sleep(WAL_CHECKPOINT_INTERVAL_SEC)
+        # Wait for an idle moment: no write holding the lock
+        while _lock.locked():
+            await asyncio.sleep(1)
+        try:
+            await checkpoint()
+        except Exception:
+            logger.exception("WAL checkpoint failed")
+
+
+def start_checkpointer():
+    global _checkpoint_task
+    if _checkpoint_task is None:
+        _checkpoint_task = asyncio.create_task(_checkpoint_loop())
+
+
+async def close():
+    global _conn, _checkpoint_task
+    if _checkpoint_task is not None:
+        _checkpoint_task.cancel()
+        _checkpoint_task = None
+    if _conn is not None:
+        await _conn.close()
+        _conn = None
+
+
+CREATE_INDEXES = (
+    # get_pending_jobs: filter by status, ordered by created_at
+    "CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs(status, created_at)",
+    # get_jobs_by_upload
+    "CREATE INDEX IF NOT EXISTS idx_jobs_upload_created ON jobs(upload_id, created_at DESC)",
+    # list_uploads
+    "CREATE INDEX IF NOT EXISTS idx_uploads_created ON uploads(created_at DESC)",
+    # find_completed_job: dedupe by content
+    "CREATE INDEX IF NOT EXISTS idx_uploads_content_hash ON uploads(content_hash)",
+)
+
+
+async def _migrate(db: aiosqlite.Connection):
+    """Add columns introduced after the first schema to existing databases."""
+    cursor = await db.execute("PRAGMA table_info(uploads)")
+    columns = {row[1] for row in await cursor.fetchall()}
+    await cursor.close()
+    if "content_hash" not in columns:
+        await db.execute("ALTER TABLE uploads ADD COLUMN content_hash TEXT")
 
 
 async def init_db():
-    db = await get_db()
-    await db.execute(CREATE_UPLOADS)
-    await db.execute(CREATE_JOBS)
-    await db.commit()
-    await db.close()
+    db = await connect()
+    # WAL is persistent: readers no longer block the job-status writers
+    await db.execute("PRAGMA journal_mode=WAL")
+    async with _lock:
+        await db.execute(CREATE_UPLOADS)
+        await db.execute(CREATE_JOBS)
+        await _migrate(db)
+        for stmt in CREATE_INDEXES:
+            await db.execute(stmt)
+        await db.commit()
+
+
+_stmt_cache: dict[tuple[str, tuple[str, ...]], str] = {}
+
+
+def _update_sql(table: str, fields: dict) -> str:
+    """
+    UPDATE text per (table, field set), built once.  Identical text lets
+    sqlite3's statement cache skip re-parsing hot status transitions.
+    """
+    key = (table, tuple(sorted(fields)))
+    sql = _stmt_cache.get(key)
+    if sql is None:
+        sets = ", ".join(f"{k} = :{k}" for k in key[1])
+        sql = _stmt_cache[key] = f"UPDATE {table} SET {sets} WHERE id = :id"
+    return sql
 
 
 # ── Uploads ────────────────────────────────────────────
 async def insert_upload(record: dict):
-    db = await get_db()
-    await db.execute(
-        """INSERT INTO uploads
-           (id, user_id, original_filename, storage_key, mime_type, file_size, status, created_at)
-           VALUES (:id, :user_id, :original_filename, :storage_key, :mime_type, :file_size, :status, :created_at)""",
-        record,
-    )
-    await db.commit()
-    await db.close()
+    async with _lock:
+        await _conn.execute(
+            """INSERT INTO uploads
+               (id, user_id, original_filename, storage_key, mime_type, file_size, status, created_at)
+               VALUES (:id, :user_id, :original_filename, :storage_key, :mime_type, :file_size, :status, :created_at)""",
+            record,
+        )
+        await _conn.commit()
 
 
 async def update_upload(upload_id: str, fields: dict):
-    sets = ", ".join(f"{k} = :{k}" for k in fields)
+    sql = _update_sql("uploads", fields)
     fields["id"] = upload_id
-    db = await get_db()
-    await db.execute(f"UPDATE uploads SET {sets} WHERE id = :id", fields)
-    await db.commit()
-    await db.close()
+    async with _lock:
+        await _conn.execute(sql, fields)
+        await _conn.commit()
+
+
+async def get_upload(upload_id: str) -> aiosqlite.Row | None:
+    cursor = await _conn.execute(
+        f"SELECT {UPLOAD_COLUMNS} FROM uploads WHERE id = ?", (upload_id,)
+    )
+    row = await cursor.fetchone()
+    await cursor.close()
+    return row
 
 
-async def get_upload(upload_id: str) -> dict | None:
-    db = await get_db()
-    cursor = await db.execute("SELECT * FROM uploads WHERE id = ?", (upload_id,))
+async def get_upload_paths(upload_id: str) -> tuple[str, str] | None:
+    """(storage_key, original_filename) — all the enhancement path needs."""
+    cursor = await _conn.execute(
+        "SELECT storage_key, original_filename FROM uploads WHERE id = ?", (upload_id,)
+    )
     row = await cursor.fetchone()
-    await db.close()
-    return dict(row) if row else None
+    await cursor.close()
+    return (row[0], row[1]) if row else None
 
 
-async def list_uploads(limit: int = 50, offset: int = 0) -> list[dict]:
-    db = await get_db()
-    cursor = await db.execute(
-        "SELECT * FROM uploads ORDER BY created_at DESC LIMIT ? OFFSET ?",
+async def list_uploads(limit: int = 50, offset: int = 0) -> list[aiosqlite.Row]:
+    cursor = await _conn.execute(
+        f"SELECT {UPLOAD_COLUMNS} FROM uploads ORDER BY created_at DESC LIMIT ? OFFSET ?",
         (limit, offset),
     )
     rows = await cursor.fetchall()
-    await db.close()
-    return [dict(r) for r in rows]
+    await cursor.close()
+    return rows
 
 
 # ── Jobs ───────────────────────────────────────────────
 async def insert_job(record: dict):
-    db = await get_db()
-    await db.execute(
-        """INSERT INTO jobs
-           (id, upload_id, model_name, status, created_at)
-           VALUES (:id, :upload_id, :model_name, :status, :created_at)""",
-        record,
-    )
-    await db.commit()
-    await db.close()
+    cols = ", ".join(record)
+    params = ", ".join(f":{k}" for k in record)
+    async with _lock:
+        await _conn.execute(f"INSERT INTO jobs ({cols}) VALUES ({params})", record)
+        await _conn.commit()
 
 
 async def update_job(job_id: str, fields: dict):
-    sets = ", ".join(f"{k} = :{k}" for k in fields)
+    sql = _update_sql("jobs", fields)
     fields["id"] = job_id
-    db = await get_db()
-    await db.execute(f"UPDATE jobs SET {sets} WHERE id = :id", fields)
-    await db.commit()
-    await db.close()
+    async with _lock:
+        await _conn.execute(sql, fields)
+        await _conn.commit()
 
 
-async def get_job(job_id: str) -> dict | None:
-    db = await get_db()
-    cursor = await db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+async def get_job(job_id: str) -> aiosqlite.Row | None:
+    cursor = await _conn.execute(f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,))
     row = await cursor.fetchone()
-    await db.close()
-    return dict(row) if row else None
+    await cursor.close()
+    return row
 
 
-async def get_jobs_by_upload(upload_id: str) -> list[dict]:
-    db = await get_db()
-    cursor = await db.execute(
-        "SELECT * FROM jobs WHERE upload_id = ? ORDER BY created_at DESC", (upload_id,)
+async def get_jobs_by_upload(upload_id: str) -> list[aiosqlite.Row]:
+    cursor = await _conn.execute(
+        f"SELECT {JOB_DETAIL_COLUMNS} FROM jobs WHERE upload_id = ? ORDER BY created_at DESC",
+        (upload_id,),
     )
     rows = await cursor.fetchall()
-    await db.close()
-    return [dict(r) for r in rows]
+    await cursor.close()
+    return rows
 
 
-async def get_pending_jobs() -> list[dict]:
-    db = await get_db()
-    cursor = await db.execute(
-        "SELECT * FROM jobs WHERE status IN ('pending', 'processing') ORDER BY created_at ASC"
+async def get_pending_jobs() -> list[aiosqlite.Row]:
+    cursor = await _conn.execute(
+        "SELECT id, upload_id, model_name, replicate_id, status FROM jobs"
+        " WHERE status IN ('pending', 'processing') ORDER BY created_at ASC"
     )
     rows = await cursor.fetchall()
-    await db.close()
-    return [dict(r) for r in rows]
+    await cursor.close()
+    return rows
+
+
+async def find_completed_job(content_hash: str, model_name: str) -> aiosqlite.Row | None:
+    """Most recent completed output for identical content run through the same model."""
+    cursor = await _conn.execute(
+        """SELECT j.output_key, j.output_size FROM jobs j
+           JOIN uploads u ON u.id = j.upload_id
+           WHERE u.content_hash = ? AND j.model_name = ?
+             AND j.status = 'completed' AND j.output_key IS NOT NULL
+           ORDER BY j.completed_at DESC LIMIT 1""",
+        (content_hash, model_name),
+    )
+    row = await cursor.fetchone()
+    await cursor.close()
+    return row
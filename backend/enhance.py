@@ -3,7 +3,7 @@ AI Enhancement Service — Replicate Integration
 
 Handles:
   1. Submitting video to Replicate for AI upscaling
-  2. Polling for job completion
+  2. Receiving completion via webhook (or polling when no public URL)
   3. Downloading enhanced video back to local storage
 
 Supported models:
@@ -12,10 +12,14 @@ Supported models:
 """
 
 import asyncio
+import os
+import random
 import uuid
 import logging
 from datetime import datetime, timezone
 
+import aiofiles
+import aiosqlite
 import httpx
 import replicate
 
@@ -25,6 +29,22 @@ import storage
 
 logger = logging.getLogger("skyframe.enhance")
 
+# One pooled HTTP/1.1 client for all output downloads: kept-alive connections
+# skip the TLS handshake per job, and parallel Range requests still get one
+# TCP connection each (HTTP/2 would multiplex them onto a single flow)
+_http_client = httpx.AsyncClient(
+    timeout=300,
+    follow_redirects=True,
+    limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+)
+
+
+TERMINAL_STATUSES = {"succeeded", "failed", "canceled"}
+
+
+async def close():
+    await _http_client.aclose()
+
 
 class EnhanceError(Exception):
     pass
@@ -33,7 +53,7 @@ class EnhanceError(Exception):
 async def create_enhance_job(
     upload_id: str,
     model_key: str = None,
-) -> dict:
+) -> aiosqlite.Row:
     """
     Create an AI enhancement job for an uploaded video.
     Returns the job record.
@@ -44,9 +64,6 @@ async def create_enhance_job(
     if upload["status"] != "uploaded":
         raise EnhanceError("Upload is not ready for enhancement")
 
-    if not config.REPLICATE_API_TOKEN:
-        raise EnhanceError("REPLICATE_API_TOKEN not set. Export it to enable AI enhancement.")
-
     model_key = model_key or config.DEFAULT_ENHANCE_MODEL
     model_name = config.REPLICATE_MODELS.get(model_key)
     if not model_name:
@@ -55,6 +72,28 @@ async def create_enhance_job(
     job_id = "job_" + uuid.uuid4().hex[:12]
     now = datetime.now(timezone.utc).isoformat()
 
+    # Same bytes through the same model: reuse the earlier output, skip Replicate
+    if upload["content_hash"]:
+        cached = await db.find_completed_job(upload["content_hash"], model_name)
+        if cached and storage.file_exists(cached["output_key"]):
+            logger.info(f"[{job_id}] Reusing output for identical content: {cached['output_key']}")
+            await db.insert_job({
+                "id": job_id,
+                "upload_id": upload_id,
+                "model_name": model_name,
+                "status": "completed",
+                "progress": 100,
+                "output_key": cached["output_key"],
+                "output_size": cached["output_size"],
+                "created_at": now,
+                "started_at": now,
+                "completed_at": now,
+            })
+            return await db.get_job(job_id)
+
+    if not config.REPLICATE_API_TOKEN:
+        raise EnhanceError("REPLICATE_API_TOKEN not set. Export it to enable AI enhancement.")
+
     await db.insert_job({
         "id": job_id,
         "upload_id": upload_id,
@@ -69,45 +108,89 @@ async def create_enhance_job(
     return await db.get_job(job_id)
 
 
-async def _run_prediction(job_id: str, upload: dict, model_name: str):
+async def _run_prediction(job_id: str, upload: aiosqlite.Row, model_name: str):
     """
-    Background task: submit to Replicate, poll, download result.
+    Background task: submit to Replicate, then either hand off to the
+    webhook endpoint or poll, and download the result.
     """
     try:
-        await db.update_job(job_id, {
-            "status": "processing",
-            "started_at": datetime.now(timezone.utc).isoformat(),
-        })
+        started_at = datetime.now(timezone.utc).isoformat()
 
         # The video file needs to be accessible via URL for Replicate.
+        # With PUBLIC_URL set: Replicate fetches it from our download endpoint.
         # For local dev: we upload the file to Replicate's file API.
         # For production with S3: just pass the presigned URL.
         file_path = storage.get_file_path(upload["storage_key"])
-        if not file_path.exists():
+        if not os.path.exists(file_path):
             raise EnhanceError("Source video not found in storage")
 
         logger.info(f"[{job_id}] Submitting to Replicate model: {model_name}")
 
-        # Run prediction (async polling mode)
-        prediction = await asyncio.to_thread(
-            _submit_prediction, model_name, file_path
+        webhook = (
+            f"{config.PUBLIC_URL}/api/jobs/{job_id}/webhook"
+            if config.WEBHOOKS_ENABLED else None
         )
+        video_url = (
+            f"{config.PUBLIC_URL}/api/uploads/{upload['id']}/download"
+            if config.PUBLIC_URL else None
+        )
+        prediction = await _submit_prediction(model_name, file_path, webhook, video_url)
 
         replicate_id = prediction.id
-        await db.update_job(job_id, {"replicate_id": replicate_id})
+        await db.update_job(job_id, {
+            "status": "processing",
+            "started_at": started_at,
+            "replicate_id": replicate_id,
+        })
+
+        if webhook:
+            # Replicate pushes the terminal state to /api/jobs/{id}/webhook
+            logger.info(f"[{job_id}] Replicate prediction: {replicate_id} — awaiting webhook")
+            return
 
         logger.info(f"[{job_id}] Replicate prediction: {replicate_id} — waiting...")
 
-        # Poll until done
-        result = await asyncio.to_thread(_wait_for_prediction, prediction)
+        # No public URL for webhooks: poll until done
+        result = await _wait_for_prediction(job_id, prediction)
+
+    except Exception as e:
+        await fail_job(job_id, e)
+        return
+
+    if not claim_finish(job_id):
+        return  # Already being finished (e.g. by a webhook delivery)
+    await finish_prediction(
+        job_id, upload["original_filename"], result.status, result.output, result.error
+    )
+
+
+# Jobs whose finish_prediction is running: a redelivered webhook must not
+# start a second download into the same output file
+_finishing: set[str] = set()
 
-        if result.status == "failed":
-            raise EnhanceError(f"Replicate prediction failed: {result.error}")
-        if result.status == "canceled":
+
+def claim_finish(job_id: str) -> bool:
+    """Atomically (single event loop) claim a job for finish_prediction."""
+    if job_id in _finishing:
+        return False
+    _finishing.add(job_id)
+    return True
+
+
+async def finish_prediction(job_id: str, filename: str, status: str, output, error=None):
+    """
+    Handle a terminal prediction (from polling or the webhook):
+    download the enhanced video and mark the job completed or failed.
+    Callers claim the job first with claim_finish(); the claim is released here.
+    """
+    try:
+        if status == "failed":
+            raise EnhanceError(f"Replicate prediction failed: {error}")
+        if status == "canceled":
             raise EnhanceError("Prediction was canceled")
 
         # Get the output URL
-        output_url = _extract_output_url(result)
+        output_url = _extract_output_url(output)
         if not output_url:
             raise EnhanceError("No output URL returned from Replicate")
 
@@ -115,7 +198,7 @@ async def _run_prediction(job_id: str, upload: dict, model_name: str):
 
         # Download enhanced video to local storage
         output_key = storage.generate_output_key(
-            job_id, f"enhanced_{upload['original_filename']}"
+            job_id, f"enhanced_{filename}"
         )
         output_size = await _download_output(output_url, output_key)
 
@@ -130,61 +213,92 @@ async def _run_prediction(job_id: str, upload: dict, model_name: str):
         logger.info(f"[{job_id}] ✅ Enhancement complete! Output: {output_key}")
 
     except Exception as e:
-        logger.error(f"[{job_id}] ❌ Enhancement failed: {e}")
-        await db.update_job(job_id, {
-            "status": "failed",
-            "error_message": str(e),
-            "completed_at": datetime.now(timezone.utc).isoformat(),
-        })
+        await fail_job(job_id, e)
+    finally:
+        _finishing.discard(job_id)
+
+
+async def fail_job(job_id: str, e: Exception):
+    logger.error(f"[{job_id}] ❌ Enhancement failed: {e}")
+    await db.update_job(job_id, {
+        "status": "failed",
+        "error_message": str(e),
+        "completed_at": datetime.now(timezone.utc).isoformat(),
+    })
 
 
-def _submit_prediction(model_name: str, file_path) -> "replicate.Prediction":
+async def _submit_prediction(
+    model_name: str,
+    file_path,
+    webhook: str | None = None,
+    video_url: str | None = None,
+) -> "replicate.Prediction":
     """
-    Submit a video enhancement prediction to Replicate.
-    This runs in a thread because the replicate SDK is synchronous.
+    Submit a video enhancement prediction to Replicate
+    using the SDK's native async client (no executor thread).
+    A public video_url lets Replicate fetch the source itself;
+    otherwise the file is uploaded through the API.
     """
-    # Build input based on model
-    if "real-esrgan" in model_name:
-        prediction = replicate.predictions.create(
-            model=model_name,
-            input={
-                "video_path": open(file_path, "rb"),
-                "scale": config.DEFAULT_SCALE_FACTOR,
-            },
-        )
-    elif "topazlabs" in model_name:
-        prediction = replicate.predictions.create(
-            model=model_name,
-            input={
-                "video": open(file_path, "rb"),
-            },
+    # Only ask Replicate to call back once the prediction is terminal
+    hook = {"webhook": webhook, "webhook_events_filter": ["completed"]} if webhook else {}
+
+    if video_url:
+        return await replicate.predictions.async_create(
+            model=model_name, input=_build_input(model_name, video_url), **hook,
         )
-    else:
-        # Generic fallback
-        prediction = replicate.predictions.create(
-            model=model_name,
-            input={
-                "video": open(file_path, "rb"),
-            },
+    with open(file_path, "rb") as f:
+        return await replicate.predictions.async_create(
+            model=model_name, input=_build_input(model_name, f), **hook,
         )
-    return prediction
 
 
-def _wait_for_prediction(prediction) -> "replicate.Prediction":
+def _build_input(model_name: str, video) -> dict:
+    """Model-specific input payload; video is a URL or an open file."""
+    if "real-esrgan" in model_name:
+        return {
+            "video_path": video,
+            "scale": config.DEFAULT_SCALE_FACTOR,
+        }
+    # topazlabs and generic fallback
+    return {"video": video}
+
+
+async def _wait_for_prediction(job_id: str, prediction) -> "replicate.Prediction":
     """
     Poll Replicate until prediction reaches terminal state.
+    The interval grows exponentially (capped), and progress is
+    persisted on each poll so the client sees movement.
+    Uses async_reload, so no executor thread is held while waiting.
     """
-    prediction.wait()
+    delay = config.JOB_POLL_INITIAL_SEC
+    last_progress = None
+
+    while prediction.status not in TERMINAL_STATUSES:
+        await asyncio.sleep(delay)
+        await prediction.async_reload()
+
+        progress = _progress_percent(prediction)
+        if progress is not None and progress != last_progress:
+            await db.update_job(job_id, {"progress": progress})
+            last_progress = progress
+
+        delay = min(delay * config.JOB_POLL_BACKOFF, config.JOB_POLL_MAX_SEC)
     return prediction
 
 
-def _extract_output_url(prediction) -> str | None:
+def _progress_percent(prediction) -> float | None:
+    """Replicate parses progress bars from the logs; returns 0–100 or None."""
+    progress = getattr(prediction, "progress", None)
+    if progress is None or progress.percentage is None:
+        return None
+    return round(progress.percentage * 100, 1)
+
+
+def _extract_output_url(output) -> str | None:
     """
-    Extract the output video URL from a completed prediction.
+    Extract the output video URL from a completed prediction's output.
     Replicate outputs vary by model — handle common patterns.
     """
-    output = prediction.output
-
     if output is None:
         return None
 
@@ -217,16 +331,142 @@ def _extract_output_url(prediction) -> str | None:
 async def _download_output(url: str, output_key: str) -> int:
     """
     Download enhanced video from Replicate URL to local storage.
+    Uses parallel HTTP Range requests when the CDN supports them,
+    otherwise a single streamed GET.
     """
     dest = storage.get_file_path(output_key)
     storage._ensure_dir(dest)
 
-    async with httpx.AsyncClient(timeout=300) as client:
-        async with client.stream("GET", url) as resp:
-            resp.raise_for_status()
-            total = 0
-            with open(dest, "wb") as f:
-                async for chunk in resp.aiter_bytes(1024 * 1024):
-                    f.write(chunk)
-                    total += len(chunk)
+    client = _http_client
+    # Identity encoding so Content-Length and ranges match the stored bytes
+    head = await client.head(url, headers={"Accept-Encoding": "identity"})
+    size = int(head.headers.get("content-length") or 0)
+    ranged = (
+        head.is_success
+        and head.headers.get("accept-ranges", "").lower() == "bytes"
+        and size > 0
+    )
+    if ranged:
+        try:
+            return await _download_ranged(client, url, dest, size)
+        except _RangeNotSupported as e:
+            logger.warning(f"{e}; falling back to a single GET")
+    return await _download_serial(client, url, dest)
+
+
+async def _download_serial(client: httpx.AsyncClient, url: str, dest) -> int:
+    async with client.stream("GET", url) as resp:
+        resp.raise_for_status()
+        total = 0
+        # aiofiles runs each write in a thread so the loop keeps serving requests
+        try:
+            f = await aiofiles.open(dest, "wb")
+        except FileNotFoundError:
+            storage._reensure_dir(dest)
+            f = await aiofiles.open(dest, "wb")
+        async with f:
+            async for chunk in resp.aiter_bytes(config.DOWNLOAD_CHUNK_SIZE):
+                await f.write(chunk)
+                total += len(chunk)
     return total
+
+
+def _pwrite_all(fd: int, data: bytes, offset: int):
+    """os.pwrite may write fewer bytes than asked; loop until all are written."""
+    view = memoryview(data)
+    while view:
+        n = os.pwrite(fd, view, offset)
+        view = view[n:]
+        offset += n
+
+
+class _RangeNotSupported(Exception):
+    """The server ignored a Range header (answered 200 instead of 206)."""
+
+
+def _is_retryable(e: Exception) -> bool:
+    if isinstance(e, httpx.HTTPStatusError):
+        status = e.response.status_code
+        # 4xx (e.g. 403/404 from an expired URL) will not fix itself
+        return status >= 500 or status in (408, 429)
+    return True
+
+
+async def _download_ranged(client: httpx.AsyncClient, url: str, dest, size: int) -> int:
+    """
+    Split [0, size) into DOWNLOAD_PART_SIZE ranges, fetch up to
+    DOWNLOAD_CONCURRENCY at a time and write each one in place into
+    a pre-allocated file.
+    """
+    part_size = config.DOWNLOAD_PART_SIZE
+    sem = asyncio.Semaphore(config.DOWNLOAD_CONCURRENCY)
+
+    fd = storage._retry_missing_dir(
+        dest, os.open, dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644
+    )
+    # pwrite calls running in worker threads; cancelling a range task does
+    # not stop them, so they are drained before the fd is closed (or reused)
+    writes: set[asyncio.Task] = set()
+    tasks = [
+        asyncio.create_task(
+            _fetch_range(client, url, fd, start, min(start + part_size, size) - 1, sem, writes)
+        )
+        for start in range(0, size, part_size)
+    ]
+    try:
+        os.ftruncate(fd, size)
+        await asyncio.gather(*tasks)
+    finally:
+        # On failure, stop the remaining ranges before the fd is closed
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if writes:
+            await asyncio.wait(writes)
+        os.close(fd)
+    return size
+
+
+async def _fetch_range(
+    client: httpx.AsyncClient,
+    url: str,
+    fd: int,
+    start: int,
+    end: int,
+    sem: asyncio.Semaphore,
+    writes: set[asyncio.Task],
+):
+    """
+    Fetch bytes [start, end] into fd. Retries resume from the last byte written,
+    backing off exponentially with jitter.
+    """
+    offset = start
+    async with sem:
+        for attempt in range(config.DOWNLOAD_MAX_RETRIES):
+            try:
+                headers = {"Range": f"bytes={offset}-{end}", "Accept-Encoding": "identity"}
+                async with client.stream("GET", url, headers=headers) as resp:
+                    resp.raise_for_status()
+                    if resp.status_code != 206:
+                        raise _RangeNotSupported(
+                            f"Range request not honoured (HTTP {resp.status_code})"
+                        )
+                    # Ranges address the encoded bytes: never decode here
+                    async for chunk in resp.aiter_raw(config.DOWNLOAD_CHUNK_SIZE):
+                        write = asyncio.create_task(
+                            asyncio.to_thread(_pwrite_all, fd, chunk, offset)
+                        )
+                        writes.add(write)
+                        write.add_done_callback(writes.discard)
+                        # shield: cancelling this task must not orphan the write
+                        await asyncio.shield(write)
+                        offset += len(chunk)
+                if offset != end + 1:
+                    raise EnhanceError(f"Short read for bytes {start}-{end}")
+                return
+            except (httpx.HTTPError, EnhanceError) as e:
+                if attempt == config.DOWNLOAD_MAX_RETRIES - 1 or not _is_retryable(e):
+                    raise
+                delay = 2 ** attempt + random.uniform(0, 1)
+                logger.warning(f"Range {start}-{end} failed ({e}); retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
@@ -6,14 +6,18 @@ New in v2:
   GET  /api/jobs/{id}             → Job status + progress
   GET  /api/jobs/{id}/download    → Download enhanced video
   GET  /api/uploads/{id}/jobs     → List jobs for an upload
+  POST /api/jobs/{id}/webhook     → Replicate completion callback
 """
 
+import asyncio
+import json
+import os
 import uuid
+from collections import OrderedDict
 from datetime import datetime, timezone
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, Query
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
 
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
@@ -22,8 +26,11 @@ from pydantic import BaseModel
 
 import config
 import database as db
+import enhance
 import storage
-from enhance import create_enhance_job, EnhanceError
+from responses import RangeFileResponse
+from webhooks import verify_webhook
+from enhance import create_enhance_job, claim_finish, fail_job, finish_prediction, EnhanceError
 
 # ═══════════════════════════════════════════════════════
 # App
@@ -44,10 +51,17 @@ app.add_middleware(
 async def startup():
     config.STORAGE_DIR.mkdir(parents=True, exist_ok=True)
     await db.init_db()
+    db.start_checkpointer()
     has_token = "✅" if config.REPLICATE_API_TOKEN else "❌ (set REPLICATE_API_TOKEN)"
     print(f"✦ SkyFrame API v0.2 — Replicate: {has_token}")
 
 
+@app.on_event("shutdown")
+async def shutdown():
+    await enhance.close()
+    await db.close()
+
+
 # ═══════════════════════════════════════════════════════
 # Schemas
 # ═══════════════════════════════════════════════════════
@@ -93,44 +107,68 @@ class JobDetail(BaseModel):
     downloadReady: bool
 
 
+# ═══════════════════════════════════════════════════════
+# Job status cache
+# ═══════════════════════════════════════════════════════
+# Completed/failed jobs never change again, so status polls for them
+# are served from this LRU instead of SQLite.
+TERMINAL_JOB_STATUSES = frozenset({"completed", "failed"})
+TERMINAL_JOB_CACHE_SIZE = 1024
+_terminal_jobs: OrderedDict[str, JobDetail] = OrderedDict()
+
+
 # ═══════════════════════════════════════════════════════
 # Helpers
 # ═══════════════════════════════════════════════════════
+_EXT_ERR = f"Unsupported format. Allowed: {sorted(config.ALLOWED_EXTENSIONS)}"
+_MIME_ERR = f"Unsupported MIME type. Allowed: {sorted(config.ALLOWED_MIME_TYPES)}"
+_SIZE_ERR = f"File too large. Max {config.MAX_FILE_SIZE // (1024*1024)}MB"
+
+
 def _validate_file_meta(filename: str, mime_type: str, file_size: int):
-    ext = "." + filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
-    if ext not in config.ALLOWED_EXTENSIONS:
-        raise HTTPException(400, f"Unsupported format. Allowed: {config.ALLOWED_EXTENSIONS}")
+    if os.path.splitext(filename)[1].lower() not in config.ALLOWED_EXTENSIONS:
+        raise HTTPException(400, _EXT_ERR)
     if mime_type not in config.ALLOWED_MIME_TYPES:
-        raise HTTPException(400, f"Unsupported MIME type. Allowed: {config.ALLOWED_MIME_TYPES}")
+        raise HTTPException(400, _MIME_ERR)
     if file_size > config.MAX_FILE_SIZE:
-        raise HTTPException(400, f"File too large. Max {config.MAX_FILE_SIZE // (1024*1024)}MB")
-
-
-def _job_to_detail(j: dict) -> JobDetail:
-    return JobDetail(
-        id=j["id"],
-        uploadId=j["upload_id"],
-        modelName=j["model_name"],
-        status=j["status"],
-        progress=j.get("progress") or 0,
-        errorMessage=j.get("error_message"),
-        createdAt=j["created_at"],
-        completedAt=j.get("completed_at"),
-        downloadReady=j["status"] == "completed" and bool(j.get("output_key")),
-    )
+        raise HTTPException(400, _SIZE_ERR)
 
 
-def _upload_to_detail(r: dict) -> UploadDetail:
-    return UploadDetail(
-        id=r["id"],
-        filename=r["original_filename"],
-        fileSize=r["file_size"],
-        mimeType=r["mime_type"],
-        status=r["status"],
-        durationSec=r.get("duration_sec"),
-        resolution=r.get("resolution"),
-        createdAt=r["created_at"],
-    )
+def _job_dict(j) -> dict:
+    """JobDetail-shaped dict straight from a DB row (no pydantic validation)."""
+    return {
+        "id": j["id"],
+        "uploadId": j["upload_id"],
+        "modelName": j["model_name"],
+        "status": j["status"],
+        "progress": j["progress"] or 0,
+        "errorMessage": j["error_message"],
+        "createdAt": j["created_at"],
+        "completedAt": j["completed_at"],
+        "downloadReady": j["status"] == "completed" and bool(j["output_key"]),
+    }
+
+
+def _upload_dict(r) -> dict:
+    """UploadDetail-shaped dict straight from a DB row (no pydantic validation)."""
+    return {
+        "id": r["id"],
+        "filename": r["original_filename"],
+        "fileSize": r["file_size"],
+        "mimeType": r["mime_type"],
+        "status": r["status"],
+        "durationSec": r["duration_sec"],
+        "resolution": r["resolution"],
+        "createdAt": r["created_at"],
+    }
+
+
+def _job_to_detail(j) -> JobDetail:
+    return JobDetail(**_job_dict(j))
+
+
+def _upload_to_detail(r) -> UploadDetail:
+    return UploadDetail(**_upload_dict(r))
 
 
 # ═══════════════════════════════════════════════════════
@@ -163,9 +201,13 @@ async def upload_file(upload_id: str, file: UploadFile = File(...)):
     if record["status"] not in ("uploading",):
         raise HTTPException(400, "Upload already completed or failed")
     try:
-        bytes_written = await storage.save_file(record["storage_key"], file)
+        bytes_written, content_hash, storage_key = await storage.save_file(
+            upload_id, record["original_filename"], file
+        )
         await db.update_upload(upload_id, {
             "file_size": bytes_written,
+            "storage_key": storage_key,
+            "content_hash": content_hash,
             "updated_at": datetime.now(timezone.utc).isoformat(),
         })
         return {"uploadId": upload_id, "bytesWritten": bytes_written}
@@ -201,17 +243,19 @@ async def get_upload(upload_id: str):
 
 
 @app.get("/api/uploads/{upload_id}/download")
-async def download_original(upload_id: str):
+async def download_original(upload_id: str, request: Request):
     record = await db.get_upload(upload_id)
     if not record:
         raise HTTPException(404, "Upload not found")
     if record["status"] != "uploaded":
         raise HTTPException(400, "File not ready")
     file_path = storage.get_file_path(record["storage_key"])
-    if not file_path.exists():
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
         raise HTTPException(404, "File not found in storage")
-    return FileResponse(
-        path=str(file_path),
+    return RangeFileResponse(
+        file_path, request.headers.get("range"), stat,
         filename=record["original_filename"],
         media_type=record["mime_type"],
     )
@@ -221,7 +265,7 @@ async def download_original(upload_id: str):
 async def list_uploads(limit: int = Query(50, le=100), offset: int = Query(0, ge=0)):
     records = await db.list_uploads(limit, offset)
     return {
-        "uploads": [_upload_to_detail(r).model_dump() for r in records],
+        "uploads": [_upload_dict(r) for r in records],
         "total": len(records),
     }
 
@@ -243,43 +287,88 @@ async def create_job(body: CreateJobRequest):
 @app.get("/api/jobs/{job_id}", response_model=JobDetail)
 async def get_job(job_id: str):
     """Get current status of an enhancement job."""
+    cached = _terminal_jobs.get(job_id)
+    if cached is not None:
+        _terminal_jobs.move_to_end(job_id)
+        return cached
     job = await db.get_job(job_id)
     if not job:
         raise HTTPException(404, "Job not found")
-    return _job_to_detail(job)
+    detail = _job_to_detail(job)
+    if detail.status in TERMINAL_JOB_STATUSES:
+        _terminal_jobs[job_id] = detail
+        if len(_terminal_jobs) > TERMINAL_JOB_CACHE_SIZE:
+            _terminal_jobs.popitem(last=False)
+    return detail
 
 
 @app.get("/api/jobs/{job_id}/download")
-async def download_enhanced(job_id: str):
+async def download_enhanced(job_id: str, request: Request):
     """Download the AI-enhanced video."""
     job = await db.get_job(job_id)
     if not job:
         raise HTTPException(404, "Job not found")
     if job["status"] != "completed":
         raise HTTPException(400, f"Job is not complete (status: {job['status']})")
-    if not job.get("output_key"):
+    if not job["output_key"]:
         raise HTTPException(404, "No output file")
 
     file_path = storage.get_file_path(job["output_key"])
-    if not file_path.exists():
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
         raise HTTPException(404, "Enhanced file not found in storage")
 
     # Get original filename for a nice download name
-    upload = await db.get_upload(job["upload_id"])
-    name = f"enhanced_{upload['original_filename']}" if upload else "enhanced_video.mp4"
+    paths = await db.get_upload_paths(job["upload_id"])
+    name = f"enhanced_{paths[1]}" if paths else "enhanced_video.mp4"
 
-    return FileResponse(
-        path=str(file_path),
+    return RangeFileResponse(
+        file_path, request.headers.get("range"), stat,
         filename=name,
         media_type="video/mp4",
     )
 
 
+@app.post("/api/jobs/{job_id}/webhook")
+async def prediction_webhook(job_id: str, request: Request):
+    """Replicate callback: receives the terminal prediction for a job."""
+    body = await request.body()
+    if not verify_webhook(request.headers, body):
+        raise HTTPException(401, "Invalid webhook signature")
+
+    job = await db.get_job(job_id)
+    if not job:
+        raise HTTPException(404, "Job not found")
+
+    prediction = json.loads(body)
+    if prediction.get("id") != job["replicate_id"]:
+        raise HTTPException(400, "Prediction does not belong to this job")
+    if job["status"] in TERMINAL_JOB_STATUSES:
+        return {"ok": True}  # Replicate retried a delivery we already handled
+
+    # Resolve the upload before claiming, so a failed lookup cannot leave a stale claim
+    paths = await db.get_upload_paths(job["upload_id"])
+    if not paths:
+        await fail_job(job_id, EnhanceError("Upload not found"))
+        raise HTTPException(404, "Upload not found")
+    _, filename = paths
+
+    if not claim_finish(job_id):
+        return {"ok": True}  # A concurrent delivery is already downloading
+    # Download in the background so Replicate gets a prompt 2xx
+    asyncio.create_task(finish_prediction(
+        job_id, filename, prediction.get("status"),
+        prediction.get("output"), prediction.get("error"),
+    ))
+    return {"ok": True}
+
+
 @app.get("/api/uploads/{upload_id}/jobs")
 async def list_jobs_for_upload(upload_id: str):
     """List all enhancement jobs for a given upload."""
     jobs = await db.get_jobs_by_upload(upload_id)
-    return {"jobs": [_job_to_detail(j).model_dump() for j in jobs]}
+    return {"jobs": [_job_dict(j) for j in jobs]}
 
 
 # ── Available models ───────────────────────────────────
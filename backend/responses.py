@@ -0,0 +1,92 @@
+"""
+Video file responses with HTTP Range support.
+
+Browsers scrub <video> with byte-range requests; the pinned Starlette
+FileResponse always sends the whole file.  RangeFileResponse answers a
+single `bytes=` range with 206 and otherwise behaves like FileResponse
+(full files are still streamed through Starlette's chunk loop under
+uvicorn, which does not implement `http.response.pathsend`).
+"""
+
+import asyncio
+import os
+
+from fastapi import HTTPException
+from fastapi.responses import FileResponse
+
+CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+
+def _parse_range(header: str | None, size: int) -> tuple[int, int] | None:
+    """
+    Parse a single `bytes=start-end` range into inclusive offsets.
+    Multi-range, malformed or inverted headers return None (serve the full
+    file); a well-formed range past the end raises 416.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_s, _, end_s = header[6:].strip().partition("-")
+    try:
+        if start_s:
+            start = int(start_s)
+            end = int(end_s) if end_s else size - 1
+            if end_s and end < start:
+                return None  # Invalid range-spec: ignore it (RFC 9110 §14.2)
+        else:
+            # Suffix range: last N bytes
+            suffix = int(end_s)
+            start = max(size - suffix, 0) if suffix else size
+            end = size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise HTTPException(416, "Requested range not satisfiable",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, min(end, size - 1)
+
+
+class RangeFileResponse(FileResponse):
+    def __init__(self, path, range_header: str | None, stat_result: os.stat_result, **kwargs):
+        # stat_result is passed through so Starlette does not re-stat the file
+        super().__init__(path, stat_result=stat_result, **kwargs)
+        self.headers["accept-ranges"] = "bytes"
+        self.byte_range = _parse_range(range_header, stat_result.st_size)
+        if self.byte_range:
+            start, end = self.byte_range
+            self.status_code = 206
+            self.headers["content-range"] = f"bytes {start}-{end}/{stat_result.st_size}"
+            self.headers["content-length"] = str(end - start + 1)
+
+    async def __call__(self, scope, receive, send):
+        if self.byte_range is None:
+            return await super().__call__(scope, receive, send)
+
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        start, end = self.byte_range
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            offset = start
+            while offset <= end:
+                n = min(CHUNK_SIZE, end - offset + 1)
+                chunk = await asyncio.to_thread(os.pread, fd, n, offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                await send({
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": offset <= end,
+                })
+        finally:
+            os.close(fd)
+        if offset <= end:
+            # File shrank underneath us; terminate the body cleanly
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
@@ -3,13 +3,49 @@ Storage abstraction.
 Current: local disk.  Future: swap to S3 presigned URLs.
 """
 
-from pathlib import Path
+import asyncio
+import os
+import shutil
+import sys
+import uuid
 from datetime import datetime
+
+import blake3
+
 from config import STORAGE_DIR
 
+# Plain strings + os.path on the hot paths: no Path object per call
+STORAGE_DIR_STR = str(STORAGE_DIR)
+
+
+# Parent dirs already created this process (daily upload/output dirs plus up
+# to 256 uploads/<hash[:2]>/ content dirs), so repeat writes skip the mkdir.
+# Also hit from to_thread workers: set ops are atomic under the GIL and a lost
+# race only repeats an exist_ok makedirs.
+_ensured_dirs: set[str] = set()
+
+
+def _ensure_dir(path: str):
+    parent = os.path.dirname(path)
+    if parent in _ensured_dirs:
+        return
+    os.makedirs(parent, exist_ok=True)
+    _ensured_dirs.add(parent)
+
+
+def _reensure_dir(path: str):
+    """The cached parent vanished (removed at runtime): forget it and recreate."""
+    _ensured_dirs.discard(os.path.dirname(path))
+    _ensure_dir(path)
 
-def _ensure_dir(path: Path):
-    path.parent.mkdir(parents=True, exist_ok=True)
+
+def _retry_missing_dir(path: str, fn, *args):
+    """Run fn(*args), recreating path's parent once if it raises FileNotFoundError."""
+    try:
+        return fn(*args)
+    except FileNotFoundError:
+        _reensure_dir(path)
+        return fn(*args)
 
 
 def generate_storage_key(upload_id: str, filename: str) -> str:
@@ -24,34 +60,109 @@ def generate_output_key(job_id: str, filename: str) -> str:
     return f"outputs/{now.year}/{now.month:02d}/{now.day:02d}/{job_id}_{safe}"
 
 
-def get_file_path(storage_key: str) -> Path:
-    return STORAGE_DIR / storage_key
-
-
-async def save_file(storage_key: str, file_obj) -> int:
-    dest = get_file_path(storage_key)
-    _ensure_dir(dest)
-    total = 0
+def content_key(content_hash: str, filename: str) -> str:
+    """Content-addressed key: identical bytes always map to the same file."""
+    ext = os.path.splitext(filename)[1].lower()
+    return f"uploads/{content_hash[:2]}/{content_hash}{ext}"
+
+
+def get_file_path(storage_key: str) -> str:
+    return os.path.join(STORAGE_DIR_STR, storage_key)
+
+
+COPY_CHUNK_SIZE = 8 * 1024 * 1024  # 8 MB
+
+
+# File-to-file sendfile is Linux-only (macOS requires a socket as the target)
+_HAS_FILE_SENDFILE = sys.platform.startswith("linux")
+
+
+def _sendfile_all(in_fd: int, out_fd: int):
+    size = os.fstat(in_fd).st_size
+    offset = 0
+    while offset < size:
+        sent = os.sendfile(out_fd, in_fd, offset, size - offset)
+        if sent == 0:
+            break
+        offset += sent
+
+
+def _copy_spooled(src, dest: str) -> int:
+    """
+    Copy a spooled upload to dest.
+    On Linux, rolled-to-disk spools go through os.sendfile (kernel-side copy);
+    otherwise, or if sendfile fails, copyfileobj with large chunks.
+    """
+    with open(dest, "wb") as out:
+        # _rolled is private to SpooledTemporaryFile; a missing attribute
+        # just means the portable path below
+        if _HAS_FILE_SENDFILE and getattr(src, "_rolled", False):
+            try:
+                src.flush()
+                _sendfile_all(src.fileno(), out.fileno())
+                return os.fstat(out.fileno()).st_size
+            except OSError:
+                out.seek(0)
+                out.truncate()
+        src.seek(0)
+        shutil.copyfileobj(src, out, length=COPY_CHUNK_SIZE)
+        out.flush()
+        return os.fstat(out.fileno()).st_size
+
+
+def _hash_file(path: str) -> str:
+    hasher = blake3.blake3(max_threads=blake3.blake3.AUTO)
+    hasher.update_mmap(path)
+    return hasher.hexdigest()
+
+
+def _store_spooled(src, staging: str, filename: str) -> tuple[int, str, str]:
+    try:
+        size = _retry_missing_dir(staging, _copy_spooled, src, staging)
+        content_hash = _hash_file(staging)
+        key = content_key(content_hash, filename)
+        dest = get_file_path(key)
+        if os.path.exists(dest):
+            os.remove(staging)  # Duplicate content: keep the existing copy
+        else:
+            _ensure_dir(dest)
+            _retry_missing_dir(dest, os.replace, staging, dest)
+    except BaseException:
+        if os.path.exists(staging):
+            os.remove(staging)
+        raise
+    return size, content_hash, key
+
+
+async def save_file(upload_id: str, filename: str, file_obj) -> tuple[int, str, str]:
+    """
+    Write the upload to a private staging file, hash it with BLAKE3 and
+    move it to its content-addressed key.  Content-keyed files may be
+    shared by several uploads, so they are never written to or removed here.
+    Returns (bytes_written, content_hash, content_key).
+    """
+    staging = get_file_path(f"uploads/tmp/{upload_id}.{uuid.uuid4().hex[:8]}")
+    _ensure_dir(staging)
+    return await asyncio.to_thread(_store_spooled, file_obj.file, staging, filename)
+
+
+def _write_bytes(dest: str, data: bytes):
     with open(dest, "wb") as f:
-        while chunk := await file_obj.read(1024 * 1024):
-            f.write(chunk)
-            total += len(chunk)
-    return total
+        f.write(data)
 
 
 def save_bytes(storage_key: str, data: bytes) -> int:
     dest = get_file_path(storage_key)
     _ensure_dir(dest)
-    with open(dest, "wb") as f:
-        f.write(data)
+    _retry_missing_dir(dest, _write_bytes, dest, data)
     return len(data)
 
 
 def file_exists(storage_key: str) -> bool:
-    return get_file_path(storage_key).exists()
+    return os.path.exists(get_file_path(storage_key))
 
 
 def delete_file(storage_key: str):
     path = get_file_path(storage_key)
-    if path.exists():
-        path.unlink()
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,61 @@
+"""
+Tests for HTTP Range header parsing.
+Run from backend/:  python -m unittest test_responses
+"""
+
+import unittest
+
+from fastapi import HTTPException
+
+from responses import _parse_range
+
+SIZE = 1000
+
+
+class ParseRangeTest(unittest.TestCase):
+    def assertUnsatisfiable(self, header: str, size: int = SIZE):
+        with self.assertRaises(HTTPException) as ctx:
+            _parse_range(header, size)
+        self.assertEqual(ctx.exception.status_code, 416)
+        self.assertEqual(ctx.exception.headers["Content-Range"], f"bytes */{size}")
+
+    def test_no_header(self):
+        self.assertIsNone(_parse_range(None, SIZE))
+
+    def test_explicit_range(self):
+        self.assertEqual(_parse_range("bytes=0-99", SIZE), (0, 99))
+
+    def test_end_clamped_to_size(self):
+        self.assertEqual(_parse_range("bytes=900-5000", SIZE), (900, 999))
+
+    def test_open_ended(self):
+        self.assertEqual(_parse_range("bytes=500-", SIZE), (500, 999))
+
+    def test_open_ended_past_eof(self):
+        self.assertUnsatisfiable("bytes=1000-")
+
+    def test_explicit_past_eof(self):
+        self.assertUnsatisfiable("bytes=1000-1999")
+
+    def test_suffix(self):
+        self.assertEqual(_parse_range("bytes=-100", SIZE), (900, 999))
+
+    def test_suffix_longer_than_file(self):
+        self.assertEqual(_parse_range("bytes=-5000", SIZE), (0, 999))
+
+    def test_zero_suffix(self):
+        self.assertUnsatisfiable("bytes=-0")
+
+    def test_inverted_is_ignored(self):
+        self.assertIsNone(_parse_range("bytes=10-5", SIZE))
+
+    def test_multi_range_is_ignored(self):
+        self.assertIsNone(_parse_range("bytes=0-9,20-29", SIZE))
+
+    def test_malformed_is_ignored(self):
+        self.assertIsNone(_parse_range("bytes=abc-", SIZE))
+        self.assertIsNone(_parse_range("items=0-9", SIZE))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+"""
+Tests for webhook signature verification.
+Run from backend/:  python -m unittest test_webhooks
+"""
+
+import unittest
+from unittest import mock
+
+import config
+from webhooks import verify_webhook
+
+# Standard Webhooks reference vector
+SECRET = "whsec_MfKQ9r8GKYqrTwjUPD8ILPZIo2LaLaSw"
+MSG_ID = "msg_p5jXN8AQM9LWM0D4loKWxJek"
+TIMESTAMP = 1614265330
+BODY = b'{"test": 2432232314}'
+SIGNATURE = "v1,g0hM9SsE+OTPJTGt/tmIKtSyZlE3uFJELVlNIOLJ1OE="
+
+
+def _headers(**overrides) -> dict:
+    headers = {
+        "webhook-id": MSG_ID,
+        "webhook-timestamp": str(TIMESTAMP),
+        "webhook-signature": SIGNATURE,
+    }
+    headers.update(overrides)
+    return headers
+
+
+class VerifyWebhookTest(unittest.TestCase):
+    def setUp(self):
+        patches = [
+            mock.patch.object(config, "REPLICATE_WEBHOOK_SECRET", SECRET),
+            mock.patch("webhooks.time.time", return_value=TIMESTAMP),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_valid_signature(self):
+        self.assertTrue(verify_webhook(_headers(), BODY))
+
+    def test_valid_among_multiple_signatures(self):
+        headers = _headers(**{"webhook-signature": f"v1,bogus= {SIGNATURE}"})
+        self.assertTrue(verify_webhook(headers, BODY))
+
+    def test_tampered_body(self):
+        self.assertFalse(verify_webhook(_headers(), b'{"test": 2432232315}'))
+
+    def test_wrong_signature(self):
+        headers = _headers(**{"webhook-signature": "v1,Ceo5qEr07ixe2NLpvHk3FH9bwy/WavXrAFQ/9tdO6mc="})
+        self.assertFalse(verify_webhook(headers, BODY))
+
+    def test_missing_headers(self):
+        self.assertFalse(verify_webhook({}, BODY))
+
+    def test_stale_timestamp(self):
+        with mock.patch("webhooks.time.time", return_value=TIMESTAMP + config.WEBHOOK_TOLERANCE_SEC + 1):
+            self.assertFalse(verify_webhook(_headers(), BODY))
+
+    def test_no_secret_configured(self):
+        with mock.patch.object(config, "REPLICATE_WEBHOOK_SECRET", ""):
+            self.assertFalse(verify_webhook(_headers(), BODY))
+
+
+if __name__ == "__main__":
+    unittest.main()